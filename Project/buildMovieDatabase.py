@@ -1,6 +1,7 @@
 import database
 import pandas as pd
 from ingestRatings import main as ingest_main 
+from readRatings import make_session
 import asyncio
 
 
@@ -12,15 +13,39 @@ def get_user_list() -> list:
         usecols=["UserIDs"], # only load that one column
         dtype={"UserIDs": str},  # ensure they’re read as strings
         skiprows=0,
-        nrows = 32
+        nrows = 32,
+        engine="calamine"          # Rust reader, much lighter than openpyxl
     )
     return userIds
 
 
 
-async def build_database(userList):
-    for userId in userList.UserIDs:
-        await ingest_main(userId)
+async def build_database(userList, concurrency: int = 8, pool_size: int = 20):
+    # Scrape several users at once; the semaphore keeps us under Letterboxd's rate limits
+    sem = asyncio.Semaphore(concurrency)
+    # split the pool between the users in flight, so pages don't queue for a connection
+    page_concurrency = max(1, pool_size // concurrency)
+
+    # One pooled session for every user, so connections are reused across them
+    async with make_session(pool_size) as session:
+
+        async def _one(userId) -> bool:
+            async with sem:
+                # one user timing out must not tear down the session under the others
+                try:
+                    await ingest_main(userId, session, concurrency=page_concurrency)
+                except Exception as e:
+                    print(f"[SCRAPE ERROR] Failed to ingest {userId!r}: {e!r}")
+                    return False
+                return True
+
+        userIds = list(userList.UserIDs)
+        results = await asyncio.gather(*[_one(userId) for userId in userIds])
+
+    failed = [userId for userId, ok in zip(userIds, results) if not ok]
+    if failed:
+        print(f"{len(failed)}/{len(userIds)} users failed, re-run them: {failed}")
+    return failed
 
 async def main():
 
@@ -1,31 +1,21 @@
 # ingest_ratings.py
 import asyncio
 import sys
-from readRatings import fetch_rating_info
+from aiohttp import ClientSession
+from readRatings import fetch_rating_tuples, make_session
 import database
 import psycopg2
 from psycopg2 import DatabaseError
 
 
-async def insert_ratings(username: str):
-    #Scrapes all movie of a user and the ratings
-    films = await fetch_rating_info(username)
-
-    # Prepare rows
-    rating_rows = []
-    movies_row = []
-    for f in films:
-        slug    = f["slug"]
-        rating = float(f["rating"]) if f.get("rating") else None
-        liked  = bool(f["liked"])
-        if rating is not None:
-            rating_rows.append((username, rating, liked, slug))
-            movies_row.append((slug,))
-
-    #preparing insertions for user pool table
-    lastRating = films[-1]
-    display_name = lastRating["display_name"]
-    last_page = lastRating["page"]
+async def insert_ratings(session: ClientSession, username: str, start_page: int = 1, concurrency: int = 20):
+    #Scrapes the movies of a user and the ratings, already shaped as db rows
+    #start_page lets a re-ingest skip the pages that are already in the db
+    #concurrency caps this user's pages in flight on the (possibly shared) session
+    rating_rows, display_name, last_page = await fetch_rating_tuples(
+        session, username, start_page, concurrency=concurrency
+    )
+    movies_row = [(r[3],) for r in rating_rows]
 
 
     # Insert ratings into `ratings` table
@@ -37,10 +27,6 @@ async def insert_ratings(username: str):
         print(f"Inserted/updated {len(rating_rows)} ratings for {username!r}")
 
     # Upsert into `user_pool` table
-    last = films[-1]
-    display_name = last["display_name"]
-    last_page    = last["page"]
-
     try:
         database.upsert_user_pool(username, display_name, last_page)
     except DatabaseError as e:
@@ -58,13 +44,24 @@ async def insert_ratings(username: str):
 
 
 
-async def main(username: str):
-   await insert_ratings(username)
+async def main(
+    username: str,
+    session: ClientSession | None = None,
+    start_page: int = 1,
+    concurrency: int = 20
+):
+   # reuse the caller's session when scraping many users in one run
+   if session is not None:
+       await insert_ratings(session, username, start_page, concurrency)
+       return
+   async with make_session(concurrency) as session:
+       await insert_ratings(session, username, start_page, concurrency)
 
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python ingest_ratings.py <letterboxd_username>")
+        print("Usage: python ingest_ratings.py <letterboxd_username> [start_page]")
         sys.exit(1)
-    asyncio.run(main(sys.argv[1]))
\ No newline at end of file
+    start_page = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    asyncio.run(main(sys.argv[1], start_page=start_page))
\ No newline at end of file
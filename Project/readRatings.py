@@ -1,153 +1,301 @@
 import asyncio
 import aiohttp
+import logging
+import orjson
 import pprint
+import time
+from email.utils import formatdate
+from pathlib import Path
 from aiohttp import ClientSession, TCPConnector
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
+
+log = logging.getLogger(__name__)
+
+# Parsed rows of every scraped page, so a rerun doesn't refetch unchanged users
+CACHE_DIR = Path(__file__).resolve().parent / ".cache"
+CACHE_TTL = 24 * 60 * 60  # seconds before a cached page is revalidated
+
+def _has_class(name: str) -> str:
+    """XPath predicate matching one token of an element's class attribute."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# Letterboxd serves UTF-8; decoding the raw bytes in libxml2 skips a str round trip
+_HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+# Compiled once at import, evaluated by libxml2 for every page
+_XP_DISPLAY_NAME = etree.XPath(
+    f"//nav[{_has_class('profile-navigation')}]//h1[{_has_class('title-3')}]"
+)
+_XP_PAGE_NUMBERS = etree.XPath(
+    f"//div[{_has_class('paginate-pages')}]//li[{_has_class('paginate-page')}]"
+)
+_XP_ITEMS = etree.XPath(
+    f"//ul[{_has_class('grid')} and {_has_class('-p70')}]/li[{_has_class('griditem')}]"
+)
+# react component div plus the rating span of one item, in document order
+_XP_FIELDS = etree.XPath(
+    f".//div[{_has_class('react-component')}]"
+    f" | .//p[{_has_class('poster-viewingdata')}]//span[{_has_class('rating')}]"
+)
+# evaluates straight to True/False, the class-token test runs inside libxml2
+_XP_LIKED = etree.XPath(
+    f"boolean(.//p[{_has_class('poster-viewingdata')}]"
+    f"//span[{_has_class('like')} and {_has_class('liked-micro')}])"
+)
+
+# Letterboxd only ever renders these ten star strings ("½" … "★★★★★")
+_STAR_TABLE = {"★" * (score // 2) + "½" * (score % 2): score for score in range(1, 11)}
 
 def stars_to_score(star_str: str) -> int | None:
     """
     Convert a Letterboxd star string (e.g. "★★★½") into a 0–10 integer.
     """
-    if not star_str:
-        return None
-    full = star_str.count("★")
-    half = star_str.count("½")
-    return full*2 + half
+    return _STAR_TABLE.get(star_str)
+
+def _parse_page(page_html: bytes) -> list[tuple]:
+    """
+    Parse one film‑list page into (slug, title, rating, liked) tuples.
+    Returns an empty list when the page has no films.
+    """
+    tree = lxml.html.fromstring(page_html, parser=_HTML_PARSER)
+    rows: list[tuple] = []
+
+    # film items of the grid container
+    for li in _XP_ITEMS(tree):
+        #print(li)
+
+        # Harvest react component and rating from one walk of the item
+        react_component = None
+        rating = None
+        for el in _XP_FIELDS(li):
+            if el.tag == "div":
+                if react_component is None:
+                    react_component = el
+            else:
+                # the stars are the span's only text node, no need to join descendants
+                rating = stars_to_score((el.text or "").strip())
+        liked = _XP_LIKED(li)
+
+        # Get film info from the react component div (new structure)
+        if react_component is None:
+            log.debug("not info")
+            continue
+
+        # Get slug from data-item-slug attribute (new structure)
+        slug = react_component.get("data-item-slug")
+        if not slug:
+            log.debug("no slug found")
+            continue
+
+        # Get title from data-item-name attribute (new structure)
+        title = react_component.get("data-item-name")
+
+        # poster URL
+       # img = li.find("img")
+       # poster_url = img["src"] if img and img.has_attr("src") else None
+
+        rows.append((slug, title, rating, liked))
+
+    return rows
+
+def _cache_path(username: str, page: int) -> Path:
+    return CACHE_DIR / username / f"p{page}.json"
+
+def _write_cache(path: Path, rows: list[tuple]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(orjson.dumps(rows))
+
+def make_session(concurrency: int = 20, timeout: float = 10.0) -> ClientSession:
+    """
+    Build the pooled session shared by every scrape, so DNS lookups and
+    TLS handshakes to letterboxd.com are paid once instead of per user.
+    At most `concurrency` connections are open; callers sharing the
+    session should split that budget between them.
+    """
+    headers = {
+        "User-Agent": "Mozilla/5.0 (compatible; AsyncScraper/1.0)"
+    }
+    conn = TCPConnector(
+        limit=64,
+        limit_per_host=concurrency,
+        ttl_dns_cache=600,
+        keepalive_timeout=30
+    )
+    # per-socket limits only: time spent queued for a free pooled connection
+    # is not a stalled request and must not count against it
+    client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+    return ClientSession(connector=conn, timeout=client_timeout, headers=headers)
+
+async def _scrape_pages(
+    session: ClientSession,
+    username: str,
+    start_page: int,
+    max_pages: int,
+    concurrency: int
+) -> tuple[str | None, list[tuple[int, list[tuple]]]]:
+    """
+    Fetch and parse a user's film‑list pages from start_page onwards.
+    Returns the display name and a (page, rows) pair for every non-empty page,
+    rows being the tuples produced by _parse_page.
+    Pages parsed less than CACHE_TTL ago are read back from CACHE_DIR.
+    Raises RuntimeError if the /films/ profile page itself can't be fetched.
+    """
+    pages: list[tuple[int, list[tuple]]] = []
+
+    # 1) Fetch first page to get display name and page count
+    first_url = f"https://letterboxd.com/{username}/films/"
+    async with session.get(first_url) as resp:
+        # without this page the page count is unknown; guessing 1 would
+        # store a truncated user as complete, so fail the user instead
+        if resp.status != 200:
+            raise RuntimeError(f"Profile page for {username!r} returned {resp.status}")
+        first_html = await resp.read()
+    root = lxml.html.fromstring(first_html, parser=_HTML_PARSER)
+    name_tags = _XP_DISPLAY_NAME(root)
+    display_name = name_tags[0].text_content().strip() if name_tags else None
+    page_numbers = [li.text_content().strip() for li in _XP_PAGE_NUMBERS(root)]
+    total_pages = max((int(n) for n in page_numbers if n.isdigit()), default=1)
+    last_page = min(total_pages, max_pages)
+
+    # 2) Fetch all film‑list pages concurrently
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch_page(page: int) -> list | None:
+        url = f"https://letterboxd.com/{username}/films/by/date-earliest/page/{page}/"
+        cache_path = _cache_path(username, page)
+        try:
+            cached_at = cache_path.stat().st_mtime
+        except FileNotFoundError:
+            cached_at = None
+        if cached_at is not None and time.time() - cached_at < CACHE_TTL:
+            return orjson.loads(cache_path.read_bytes())
+
+        # stale copy: let the server answer 304 if the page hasn't changed
+        headers = {"If-Modified-Since": formatdate(cached_at, usegmt=True)} if cached_at else None
+        async with sem:
+            async with session.get(url, headers=headers) as resp:
+                status = resp.status
+                log.debug("GET %s → %s", url, status)
+                if status == 304:
+                    cache_path.touch()
+                    return orjson.loads(cache_path.read_bytes())
+                if status != 200:
+                    log.warning("Non‑200 response on page %s", page)
+                    # later pages are pointless once one fails
+                    for task in tasks[page - start_page + 1:]:
+                        task.cancel()
+                    return None
+                page_html = await resp.read()
+
+        # cheap memchr scan: pages past the end have no grid items to parse
+        if b"griditem" not in page_html:
+            return []
+        rows = _parse_page(page_html)
+        if rows:
+            _write_cache(cache_path, rows)
+        return rows
+
+    tasks = [asyncio.create_task(fetch_page(page)) for page in range(start_page, last_page + 1)]
+    pages_rows = await asyncio.gather(*tasks, return_exceptions=True)
+
+    # 3) Keep pages in order, stopping at the first failed or empty one
+    for page, rows in enumerate(pages_rows, start=start_page):
+        if isinstance(rows, Exception):
+            raise rows
+        if not isinstance(rows, list) or not rows:
+            break
+        pages.append((page, rows))
+
+    return display_name, pages
 
 async def fetch_rating_info(
+    session: ClientSession,
     username: str,
+    start_page: int = 1,
     max_pages: int = 50,
-    concurrency: int = 20,
-    timeout: float = 10.0
+    concurrency: int = 20
 ) -> list[dict]:
     """
     Scrape a user's Letterboxd film‑list pages via aiohttp.
     Returns a list of dicts with keys:
       slug, title, poster_url, rating, liked, display_name, year (None or int)
     """
-    # Prepare a single session with connection pooling
-    headers = {
-        "User-Agent": "Mozilla/5.0 (compatible; AsyncScraper/1.0)"
-    }
-    conn = TCPConnector(limit_per_host=concurrency)
-    client_timeout = aiohttp.ClientTimeout(total=timeout)
-
-    async with ClientSession(connector=conn, timeout=client_timeout, headers=headers) as session:
-        all_films: list[dict] = []
-
-        # 1) Fetch first page to get display name
-        first_url = f"https://letterboxd.com/{username}/films/"
-        async with session.get(first_url) as resp:
-            text = await resp.text()
-        root_soup = BeautifulSoup(text, "lxml")
-        name_tag = root_soup.select_one("nav.profile-navigation h1.title-3")
-        display_name = name_tag.get_text(strip=True) if name_tag else None
-      
-
-        # 2) Sequentially page through film‑list pages
-        for page in range(1, max_pages + 1):
-            url = f"https://letterboxd.com/{username}/films/by/date-earliest/page/{page}/"
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    break
-                status = resp.status    
-                print(f"[DEBUG] GET {url} → {status}")
-                page_html = await resp.text()
-
-            if status != 200:
-                print(f"[WARN] Non‑200 response on page {page}")
-
-
-            soup = BeautifulSoup(page_html, "lxml")
-
-            # find ul container
-            ul = soup.find("ul", class_="grid -p70")
-            if not ul:
-                break
-
-            items = ul.find_all("li", class_="griditem")
-            #print(items)
-            if not items:
-                break
-
-            #filling up film info
-            for li in items:
-                #print(li)
-
-                # Get film info from the react component div (new structure)
-                react_component = li.find("div", class_="react-component")
-                if not react_component:
-                    print("not info")
-                    continue
-                
-                # Get slug from data-item-slug attribute (new structure)
-                slug = react_component.get("data-item-slug")
-                if not slug:
-                    print("no slug found")
-                    continue
-
-                # Get title from data-item-name attribute (new structure)
-                title = react_component.get("data-item-name")
-
-                # rating 
-                viewing_data = li.find("p", class_="poster-viewingdata")
-                rating = None
-                if viewing_data:
-                    ratingLocation = viewing_data.find("span", class_="rating")
-                    rating = stars_to_score(ratingLocation.get_text(strip=True)) if ratingLocation else None
-
-                # liked? 
-                liked = False
-                if viewing_data:
-                    liked_span = viewing_data.find("span", class_="like")
-                    liked = bool(liked_span and "liked-micro" in liked_span.get("class", []))
-
-                # poster URL
-               # img = li.find("img")
-               # poster_url = img["src"] if img and img.has_attr("src") else None
-
-                all_films.append({
-                    "slug":         slug,
-                    "title":        title,
-                    "poster_url":   None,
-                    "display_name": display_name,
-                    "rating":       rating,
-                    "liked":        liked,
-                    "year":         None,
-                    "page":         page
-                })
-             
-            """
-        if fetch_years and all_films:
-            # A) make a semaphore to limit concurrency
-            year_sem = asyncio.Semaphore(concurrency)
-            # B) helper to fetch & parse one film
-            async def sem_fetch_year(film):
-                async with year_sem:
-                    detail_url = f"https://letterboxd.com/film/{film['slug']}/"
-                    async with session.get(detail_url) as resp:
-                        if resp.status == 200:
-                            html = await resp.text()
-                            film["year"] = parse_year_from_html(html)
-                        else:
-                            film["year"] = None
-
-
-            # C) schedule one task per film
-            tasks = [asyncio.create_task(sem_fetch_year(f)) for f in all_films]
-        
-
-            # D) wait for them all to finish
-            await asyncio.gather(*tasks
-            """
-
-        return all_films
+    display_name, pages = await _scrape_pages(session, username, start_page, max_pages, concurrency)
+
+    all_films: list[dict] = [
+        {
+            "slug":         slug,
+            "title":        title,
+            "poster_url":   None,
+            "display_name": display_name,
+            "rating":       rating,
+            "liked":        liked,
+            "year":         None,
+            "page":         page
+        }
+        for page, rows in pages
+        for slug, title, rating, liked in rows
+    ]
+    """
+    if fetch_years and all_films:
+        # A) make a semaphore to limit concurrency
+        year_sem = asyncio.Semaphore(concurrency)
+        # B) helper to fetch & parse one film
+        async def sem_fetch_year(film):
+            async with year_sem:
+                detail_url = f"https://letterboxd.com/film/{film['slug']}/"
+                async with session.get(detail_url) as resp:
+                    if resp.status == 200:
+                        html = await resp.text()
+                        film["year"] = parse_year_from_html(html)
+                    else:
+                        film["year"] = None
+
+
+        # C) schedule one task per film
+        tasks = [asyncio.create_task(sem_fetch_year(f)) for f in all_films]
+    
+
+        # D) wait for them all to finish
+        await asyncio.gather(*tasks
+    """
+
+    return all_films
+
+async def fetch_rating_tuples(
+    session: ClientSession,
+    username: str,
+    start_page: int = 1,
+    max_pages: int = 50,
+    concurrency: int = 20
+) -> tuple[list[tuple], str | None, int]:
+    """
+    Scrape a user's rated films straight into database rows.
+    Returns (ratings, display_name, last_page) where each rating is a
+    (username, rating, liked, slug) tuple; unrated films are skipped.
+    Pass the previously stored last page as start_page to only walk new pages.
+    """
+    display_name, pages = await _scrape_pages(session, username, start_page, max_pages, concurrency)
+
+    ratings = [
+        (username, float(rating), liked, slug)
+        for _, rows in pages
+        for slug, _, rating, liked in rows
+        if rating is not None
+    ]
+    # nothing new means the stored last page still stands
+    last_page = pages[-1][0] if pages else start_page - 1
+    return ratings, display_name, last_page
     
 async def main():
-    films = await fetch_rating_info(
-        username= "613dbx"
-    )
+    async with make_session() as session:
+        films = await fetch_rating_info(
+            session,
+            username= "613dbx"
+        )
     pprint.pprint(films)
     
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
     asyncio.run(main())
\ No newline at end of file
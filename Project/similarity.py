@@ -1,32 +1,102 @@
-from surprise import Dataset, NormalPredictor, Reader, accuracy, SVD, KNNBasic
-from surprise.model_selection import cross_validate, KFold
+from collections import defaultdict
+from surprise import NormalPredictor, Trainset, accuracy, KNNBasic
+import numpy as np
 import pandas as pd 
+from scipy.sparse import csr_matrix
+from sklearn.decomposition import TruncatedSVD
+from sklearn.model_selection import KFold
 
-df = pd.read_csv("data/RatingsToTrainSample.csv")
+df = pd.read_csv(
+    "data/RatingsToTrainSample.csv",
+    engine="pyarrow",               # multithreaded parser
+    dtype={"user_id": "string[pyarrow]", "movie_id": "string[pyarrow]", "rating": "float32"}
+)
 #print(df.head())   # Shows first 5 rows
 #print(df.columns)  # Shows column names
 
-reader = Reader(rating_scale=(1, 10))
+rating_scale = (1, 10)
 
-# The columns must correspond to user id, item id and ratings (in that order).
-data = Dataset.load_from_df(df[["user_id", "movie_id", "rating"]], reader)
+# map user / movie ids to row / column indices of a sparse rating matrix
+users, user_ids = pd.factorize(df["user_id"])
+movies, movie_ids = pd.factorize(df["movie_id"])
+ratings = df["rating"].to_numpy(dtype=np.float64)
+shape = (len(user_ids), len(movie_ids))
 
-# We can now use this dataset as we please, e.g. calling cross_validate
-cross_validate(NormalPredictor(), data, cv=2)
+# the factorized codes double as Surprise's inner ids
+raw_users = np.asarray(user_ids, dtype=object)
+raw_movies = np.asarray(movie_ids, dtype=object)
+raw2inner_users = {raw: inner for inner, raw in enumerate(raw_users)}
+raw2inner_movies = {raw: inner for inner, raw in enumerate(raw_movies)}
+
+
+def group_by(keys, others, values, n_keys):
+    """
+    Build Surprise's {inner_id: [(other_inner_id, rating), …]} mapping
+    by sorting the code arrays instead of re-parsing every row.
+    """
+    order = np.argsort(keys, kind="stable")
+    bounds = np.searchsorted(keys[order], np.arange(n_keys + 1))
+    pairs = list(zip(others[order].tolist(), values[order].tolist()))
+    return defaultdict(list, {
+        key: pairs[bounds[key]:bounds[key + 1]]
+        for key in range(n_keys) if bounds[key] < bounds[key + 1]
+    })
+
+
+def build_trainset(idx):
+    """Surprise Trainset over the ratings at idx, skipping Dataset/Reader."""
+    return Trainset(
+        ur=group_by(users[idx], movies[idx], ratings[idx], shape[0]),
+        ir=group_by(movies[idx], users[idx], ratings[idx], shape[1]),
+        n_users=shape[0],
+        n_items=shape[1],
+        n_ratings=len(idx),
+        rating_scale=rating_scale,
+        raw2inner_id_users=raw2inner_users,
+        raw2inner_id_items=raw2inner_movies
+    )
 
 
 # define a cross-validation iterator
-kf = KFold(n_splits=3)
+kf = KFold(n_splits=3, shuffle=True)
+
+baseline = NormalPredictor()
+# few users, so keep the rank small or the factors just memorise the train ratings
+svd = TruncatedSVD(n_components=min(8, min(shape) - 1), algorithm="randomized")
+# shrinks the bias of movies with only a handful of ratings towards 0
+item_damping = 5
+
+for train_idx, test_idx in kf.split(ratings):
 
-algo = SVD()
+    # random baseline, for comparison
+    baseline.fit(build_trainset(train_idx))
+    testset = zip(raw_users[users[test_idx]], raw_movies[movies[test_idx]], ratings[test_idx])
+    print("NormalPredictor", end=" ")
+    accuracy.rmse(baseline.test(testset), verbose=True)
 
-for trainset, testset in kf.split(data):
+    # remove the global mean, then per-user and (damped) per-movie biases, so the
+    # factors only model the interaction and missing cells count as "expected", not 0 stars
+    u_train, m_train = users[train_idx], movies[train_idx]
+    mean = ratings[train_idx].mean()
+    residual = ratings[train_idx] - mean
+    user_counts = np.bincount(u_train, minlength=shape[0])
+    user_bias = np.bincount(u_train, residual, minlength=shape[0]) / np.maximum(user_counts, 1)
+    residual -= user_bias[u_train]
+    movie_counts = np.bincount(m_train, minlength=shape[1])
+    movie_bias = np.bincount(m_train, residual, minlength=shape[1]) / (movie_counts + item_damping)
+    residual -= movie_bias[m_train]
+    R = csr_matrix((residual, (u_train, m_train)), shape=shape)
 
     # train and test algorithm.
-    algo.fit(trainset)
-    predictions = algo.test(testset)
+    user_factors = svd.fit_transform(R)     # U·Σ
+    movie_factors = svd.components_.T       # V
+    predictions = mean + user_bias[users[test_idx]] + movie_bias[movies[test_idx]] + np.einsum(
+        "ij,ij->i", user_factors[users[test_idx]], movie_factors[movies[test_idx]]
+    )
+    predictions = np.clip(predictions, *rating_scale)
 
     # Compute and print Root Mean Squared Error
-    accuracy.rmse(predictions, verbose=True)
+    rmse = np.sqrt(np.mean((predictions - ratings[test_idx]) ** 2))
+    print(f"TruncatedSVD RMSE: {rmse:1.4f}")
 
 
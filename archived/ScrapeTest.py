@@ -2,52 +2,219 @@
 
 import asyncio
 import aiohttp
-from aiohttp import ClientSession
-from bs4 import BeautifulSoup
-from selenium import webdriver
+import random
+import re
+import shelve
+import sys
 import time
-
-# ─────── STEP 1: “Scrape all <film-slug> values from the user’s ‘Films’ page” ───────
-
-def fetch_all_slugs(username: str, driver_path: str = None, headless: bool = True) -> list[str]:
-    """
-    Uses Selenium to open https://letterboxd.com/<username>/films/,
-    waits briefly for React to populate the required clasess
-    and then BeautifulSoup‐parses that HTML to extract every `data-film-slug`.
-    Returns a list of slugs (e.g. ["sinners-2025", "mickey-17", …]).
-    """
-    options = webdriver.ChromeOptions()
-    if headless:
-        options.add_argument("--headless")
-    # (You can replace with FirefoxOptions() + webdriver.Firefox() if you prefer.)
-    driver = webdriver.Chrome(options=options, executable_path=driver_path) \
-             if driver_path else webdriver.Chrome(options=options)
-    driver.get(f"https://letterboxd.com/{username}/films/")
-    
-    # Wait a couple of seconds so React can inject the <ul>…<li> elements
-    time.sleep(2)
-    html = driver.page_source
-    driver.quit()
-
-    soup = BeautifulSoup(html, "lxml")
-    # Note: the class here has to match exactly what Letterboxd uses:
-    container_ul = soup.find(
-        "ul",
-        class_="poster-list -p70 -grid clear"
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from aiohttp import ClientSession
+import lxml.html
+from lxml import etree
+
+# rate limiting and transient server errors are worth another try
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Letterboxd serves UTF-8; libxml2 decodes the raw bytes, no str round trip
+_HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+# external ids inside the IMDb / TMDb link hrefs
+_IMDB_RE = re.compile(r"/title/(tt\d+)")
+_TMDB_RE = re.compile(r"/movie/(\d+)")
+
+# film-page metadata (year, IMDb/TMDb ids) never changes once scraped
+FILM_CACHE_PATH = "film_cache.db"
+# posters do get replaced, so cached AJAX poster answers expire
+POSTER_TTL = 30 * 24 * 60 * 60  # seconds
+
+# fetch_poster_url's "couldn't ask" answer, as opposed to None for "no poster"
+POSTER_FAILED = object()
+
+# crawl output is columnar: one list per field rather than one dict per film,
+# each written to Parquet with the Arrow type named here
+FILM_COLUMNS = {
+    "slug":       "string",
+    "title":      "string",
+    "year":       "int32",
+    "imdb_id":    "string",
+    "tmdb_id":    "string",
+    "poster_url": "string"
+}
+
+
+def _has_class(name: str) -> str:
+    """XPath predicate matching one token of an element's class attribute."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# Compiled once at import, evaluated by libxml2 for every page
+_XP_ITEMS = etree.XPath(f"//ul[{_has_class('grid')}]/li[{_has_class('griditem')}]")
+_XP_FILM_INFO = etree.XPath(f".//div[{_has_class('react-component')}]")
+_XP_POSTER_SRC = etree.XPath(".//img/@src")
+_XP_TITLE = etree.XPath("//section[@id='featured-film-header']//h1")
+_XP_YEAR = etree.XPath(
+    f"//section[@id='featured-film-header']//small[{_has_class('number')}]/a/text()"
+)
+_XP_IMDB = etree.XPath("(//a[@data-track-action='IMDb'])[1]/@href")
+_XP_TMDB = etree.XPath("(//a[@data-track-action='TMDb'])[1]/@href")
+_XP_AJAX_POSTER = etree.XPath(f"//div[{_has_class('film-poster')}]//img/@src")
+
+def make_session() -> ClientSession:
+    """
+    The one session every request of a crawl goes through. Pooling keeps
+    connections to letterboxd.com alive, and the connector caps how many
+    are open so large libraries don't turn into a connection storm.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=50,
+        limit_per_host=20,
+        ttl_dns_cache=300,
+        enable_cleanup_closed=True
     )
-    if not container_ul:
-        raise RuntimeError("Could not find the <ul class='poster-list … film-list …'> in the HTML")
-    
-    slugs = []
-    for li in container_ul.find_all("li", class_="poster-container"):
-        # Each <li> has a <div … data-film-slug="…"> somewhere inside it
-        div = li.find("div", class_="react-component poster film-poster linked-film-poster")
-        if div and div.has_attr("data-film-slug"):
-            slugs.append(div["data-film-slug"])
-    return slugs
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers={"User-Agent": "Mozilla/5.0 (compatible; AsyncScraper/1.0)"},
+        timeout=aiohttp.ClientTimeout(total=30)
+    )
+
+
+def _retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+async def get_with_retry(
+    session: ClientSession,
+    url: str,
+    max_retries: int = 3,
+    base: float = 1.0
+) -> bytes | None:
+    """
+    GETs url and returns the raw response body. 429/5xx responses and connection
+    errors are retried with jittered exponential backoff, honouring
+    Retry-After when the server sends one. Returns None for any other
+    non-200 status, or once the retries are used up.
+    """
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    return await resp.read()
+                if resp.status not in RETRY_STATUSES:
+                    return None
+                retry_after = _retry_after(resp.headers.get("Retry-After"))
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+        if attempt == max_retries:
+            break
+        if retry_after is None:
+            retry_after = base * 2 ** attempt * (1 + random.random() * 0.5)
+        await asyncio.sleep(min(retry_after, 30))
+    return None
+
+
+# ─────── STEP 1: “Scrape every film (slug, title, poster) from the user’s ‘Films’ grid” ───────
+
+def _clean_poster_url(src: str | None) -> str | None:
+    """
+    Strips resize arguments off a poster URL; None for a missing poster or
+    Letterboxd's default “empty”‐poster graphic.
+    """
+    if not src:
+        return None
+    # strip off any “?v=…” or other resize arguments:
+    src = src.partition("?")[0]
+    # If it’s literally the default “empty”‐poster graphic, drop it:
+    if "empty-poster" in src:
+        return None
+    return src
 
 
-# ─────── STEP 2a: For each slug, fetch its main film page and parse out title/year/IMDb/TMDb ───────
+async def fetch_all_slugs(username: str, session: ClientSession) -> list[dict]:
+    """
+    Pages through https://letterboxd.com/<username>/films/page/<n>/ with plain
+    GETs (the film grid is server-rendered, no browser needed) and
+    lxml‐parses each page. Everything the grid already carries is
+    harvested in the same pass, so no per-film request is needed for it.
+    Returns a list of dicts, e.g.:
+      [{"slug": "sinners-2025", "title": "Sinners", "poster_url": "https://…"}, …]
+    Raises RuntimeError if a page still fails after get_with_retry's retries,
+    rather than returning a silently truncated list.
+    """
+    films = []
+    page = 1
+    while True:
+        url = f"https://letterboxd.com/{username}/films/page/{page}/"
+        html = await get_with_retry(session, url)
+        # a rate-limited page is not the end of the list
+        if html is None:
+            raise RuntimeError(f"Failed to fetch {url} after retries")
+
+        tree = _parse(html)
+        items = _XP_ITEMS(tree)
+        # the grid disappears once we're past the last page
+        if not items:
+            break
+        for li in items:
+            div = _XP_FILM_INFO(li)
+            if not div or not div[0].get("data-item-slug"):
+                continue
+            posters = _XP_POSTER_SRC(li)
+            films.append({
+                "slug":       div[0].get("data-item-slug"),
+                "title":      div[0].get("data-item-name"),
+                "poster_url": _clean_poster_url(posters[0] if posters else None)
+            })
+        page += 1
+
+    if not films:
+        raise RuntimeError("Could not find the <ul class='grid …'> film list in the HTML")
+    return films
+
+
+# ─────── STEP 2: When needed, fetch a film's main page and parse out title/year/IMDb/TMDb ───────
+
+def _parse(html: bytes):
+    """Parse a page once; every extract_* helper below reads from the same tree."""
+    return lxml.html.fromstring(html, parser=_HTML_PARSER)
+
+def extract_title(tree) -> str | None:
+    # The title + year live in <section id="featured-film-header">
+    titles = _XP_TITLE(tree)
+    return titles[0].text_content().strip() if titles else None
+
+def extract_year(tree) -> int | None:
+    # Usually the year is inside <small class="number"><a>YYYY</a></small>
+    years = _XP_YEAR(tree)
+    try:
+        return int(years[0].strip()) if years else None
+    except ValueError:
+        return None
+
+# The IMDb/TMDb external‐links (if present) have data-track-action="IMDb" or "TMDb"
+#   e.g. <a data-track-action="IMDb" href="https://www.imdb.com/title/…/">
+def extract_imdb_id(tree) -> str | None:
+    # IMDb URLs look like https://www.imdb.com/title/tt1234567/
+    # so pull out the “tt1234567” piece:
+    hrefs = _XP_IMDB(tree)
+    m = _IMDB_RE.search(hrefs[0]) if hrefs else None
+    return m.group(1) if m else None
+
+def extract_tmdb_id(tree) -> str | None:
+    # TMDb URLs look like https://www.themoviedb.org/movie/12345
+    hrefs = _XP_TMDB(tree)
+    m = _TMDB_RE.search(hrefs[0]) if hrefs else None
+    return m.group(1) if m else None
 
 async def fetch_film_page(slug: str, session: ClientSession) -> dict:
     """
@@ -56,159 +223,183 @@ async def fetch_film_page(slug: str, session: ClientSession) -> dict:
         "slug": slug,
         "title": …,
         "year": …,
-        "imdb_id": …,   # e.g. "tt1234567" or "" if none
-        "tmdb_id": …,   # e.g. "12345" or "" if none
+        "imdb_id": …,   # e.g. "tt1234567" or None if none
+        "tmdb_id": …,   # e.g. "12345" or None if none
       }
     """
     url = f"https://letterboxd.com/film/{slug}/"
-    async with session.get(url) as resp:
-        raw = await resp.text()
-        soup = BeautifulSoup(raw, "lxml")
-
-        result = {"slug": slug, "title": None, "year": None, "imdb_id": "", "tmdb_id": ""}
-        # 1) The title + year live in <section id="featured-film-header">
-        header_section = soup.find("section", {"id": "featured-film-header"})
-        if header_section:
-            h1 = header_section.find("h1")
-            result["title"] = h1.get_text(strip=True) if h1 else None
-
-            # Usually the year is inside <small class="number"><a>YYYY</a></small>
-            try:
-                year_tag = header_section.find("small", class_="number").find("a")
-                result["year"] = int(year_tag.get_text(strip=True))
-            except Exception:
-                result["year"] = None
-
-        # 2) The IMDb/TMDb external‐links (if present) have data-track-action="IMDb" or "TMDb"
-        #    e.g. <a data-track-action="IMDb" href="https://www.imdb.com/title/…/">
-        imdb_link_tag = soup.find("a", {"data-track-action": "IMDb"})
-        if imdb_link_tag and imdb_link_tag.has_attr("href"):
-            href = imdb_link_tag["href"]
-            # IMDb URLs look like https://www.imdb.com/title/tt1234567/
-            # so split out the “tt1234567” piece:
-            try:
-                result["imdb_id"] = href.split("/title/")[1].split("/")[0]
-            except:
-                result["imdb_id"] = ""
-
-        tmdb_link_tag = soup.find("a", {"data-track-action": "TMDb"})
-        if tmdb_link_tag and tmdb_link_tag.has_attr("href"):
-            href = tmdb_link_tag["href"]
-            # TMDb URLs look like https://www.themoviedb.org/movie/12345
-            try:
-                result["tmdb_id"] = href.split("/movie/")[1].split("/")[0]
-            except:
-                result["tmdb_id"] = ""
-
-        return result
-
-
-# ─────── STEP 2b: For each slug, fetch its poster via the AJAX endpoint ───────
-
-async def fetch_poster_url(slug: str, session: ClientSession) -> str:
+    raw = await get_with_retry(session, url)
+
+    if not raw:
+        return {"slug": slug, "title": None, "year": None, "imdb_id": None, "tmdb_id": None}
+    tree = _parse(raw)
+    return {
+        "slug":    slug,
+        "title":   extract_title(tree),
+        "year":    extract_year(tree),
+        "imdb_id": extract_imdb_id(tree),
+        "tmdb_id": extract_tmdb_id(tree)
+    }
+
+
+async def fetch_poster_url(slug: str, session: ClientSession) -> str | None | object:
     """
     Fetches "https://letterboxd.com/ajax/poster/film/{slug}/hero/230x345/"
     and returns the raw poster‐image URL (no resizing query parameters).
-    If it fails or there’s a fallback/“no‐poster”, returns "".
+    Returns None if there’s a fallback/“no‐poster”, and POSTER_FAILED if
+    the request itself failed, so callers only cache real answers.
     """
     ajax_url = f"https://letterboxd.com/ajax/poster/film/{slug}/hero/230x345/"
-    async with session.get(ajax_url) as resp:
-        raw = await resp.text()
-        soup = BeautifulSoup(raw, "lxml")
-
-        try:
-            img = soup.find("div", class_="film-poster").find("img")
-            if not img or not img.has_attr("src"):
-                return ""
-            src = img["src"]
-            # strip off any “?v=…” or other resize arguments:
-            src = src.split("?")[0]
-            # If it’s literally the default “empty”‐poster graphic, blank it out:
-            if "empty-poster" in src:
-                return ""
-            return src
-        except Exception:
-            return ""
+    raw = await get_with_retry(session, ajax_url)
+    if raw is None:
+        return POSTER_FAILED
+    srcs = _XP_AJAX_POSTER(_parse(raw))
+    return _clean_poster_url(srcs[0] if srcs else None)
 
 
 # ─────── STEP 3: Gather everything asynchronously ───────
 
-async def gather_everything(slugs: list[str]) -> list[dict]:
-    """
-    Given a list of slugs, concurrently fetch (a) the film page and (b) the poster URL
-    for each slug. Returns a list of combined dicts, e.g.:
-      [
-        {
-          "slug": "sinners-2025",
-          "title": "Sinners",
-          "year": 2025,
-          "imdb_id": "tt1234567",
-          "tmdb_id": "54321",
-          "poster_url": "https://a.ltrbxd.com/…/1116600-sinners-2025.jpg"
-        },
-        …
-      ]
-    """
-    results: list[dict] = []
-
-    # We’ll open ONE aiohttp.ClientSession for all requests
-    async with aiohttp.ClientSession() as session:
-        # 1) Fire off ALL film‐page fetches in parallel:
-        film_page_tasks = [
-            asyncio.create_task(fetch_film_page(slug, session))
-            for slug in slugs
-        ]
-        # 2) Fire off ALL poster‐AJAX fetches in parallel:
-        poster_tasks = [
-            asyncio.create_task(fetch_poster_url(slug, session))
-            for slug in slugs
-        ]
-
-        # Wait for all of them to finish:
-        film_page_results = await asyncio.gather(*film_page_tasks)
-        poster_results     = await asyncio.gather(*poster_tasks)
-
-        # Now unify them one‐to‐one:
-        for idx, slug in enumerate(slugs):
-            film_info = film_page_results[idx]
-            poster_url = poster_results[idx]
-            film_info["poster_url"] = poster_url
-            results.append(film_info)
-            print(results)
-
-    return results
+async def gather_everything(
+    films: list[dict],
+    session: ClientSession,
+    enrich: bool = True,
+    concurrency: int = 20,
+    cache_path: str = FILM_CACHE_PATH
+) -> dict[str, list]:
+    """
+    Given the films listed by fetch_all_slugs, concurrently fetch each film page
+    to add its year and IMDb/TMDb ids, and the AJAX poster for films whose grid
+    entry had none. With enrich=False only the grid data is
+    kept and no film page is requested. Film pages already in the
+    on-disk cache at cache_path are not fetched again; a cached AJAX poster
+    is asked for again once it's older than POSTER_TTL.
+    Returns one list per FILM_COLUMNS field, all in listing order, e.g.:
+      {
+        "slug":       ["sinners-2025", …],
+        "title":      ["Sinners", …],
+        "year":       [2025, …],
+        "imdb_id":    ["tt1234567", …],
+        "tmdb_id":    ["54321", …],
+        "poster_url": ["https://a.ltrbxd.com/…/1116600-sinners-2025.jpg", …]
+      }
+    """
+    # one slot per film in every column, filled in place as each film finishes
+    columns = {name: [None] * len(films) for name in FILM_COLUMNS}
+    if not enrich:
+        for i, film in enumerate(films):
+            _fill_row(columns, i, film)
+        return columns
+
+    # at most `concurrency` film pages in flight, so big libraries don't trip rate limits
+    sem = asyncio.Semaphore(concurrency)
+    done = 0
+    to_fetch = 0
+
+    async def enrich_film(i: int, film: dict) -> None:
+        slug = film["slug"]
+        page_info = cache.get(slug)
+        if page_info is None:
+            async with sem:
+                page_info = await fetch_film_page(slug, session)
+
+            # a page that failed to load has no title; leave it out so the next run retries
+            if page_info["title"] is not None:
+                cache[slug] = page_info
+
+            # constant-size progress line instead of dumping everything so far
+            nonlocal done
+            done += 1
+            print(f"{done}/{to_fetch} {slug}", file=sys.stderr)
+
+        # the static grid can carry only the lazy-load placeholder instead of
+        # the poster; ask the AJAX poster endpoint then, and cache its answer
+        poster_url = film.get("poster_url")
+        if not poster_url:
+            if time.time() - page_info.get("poster_fetched_at", 0) >= POSTER_TTL:
+                async with sem:
+                    fetched = await fetch_poster_url(slug, session)
+                # like a failed film page, a failed request isn't cached: the next run retries
+                if fetched is not POSTER_FAILED:
+                    page_info["poster_url"] = fetched
+                    page_info["poster_fetched_at"] = time.time()
+                    if page_info["title"] is not None:
+                        cache[slug] = page_info
+            poster_url = page_info.get("poster_url")
+
+        _fill_row(columns, i, film, page_info)
+        columns["poster_url"][i] = poster_url
+
+    with shelve.open(cache_path) as cache:
+        # progress counts film pages actually fetched, so a warm run still ends at n/n
+        to_fetch = sum(1 for film in films if film["slug"] not in cache)
+        if to_fetch < len(films):
+            print(f"{len(films) - to_fetch} film pages already cached", file=sys.stderr)
+        # Fire off every film; each writes its own slot, so listing order is kept
+        await asyncio.gather(*(enrich_film(i, film) for i, film in enumerate(films)))
+    return columns
+
+
+def _fill_row(columns: dict[str, list], i: int, film: dict, page_info: dict | None = None) -> None:
+    """
+    Write film i into its slot of every column. Grid data (slug, title, poster)
+    wins over the film page; missing fields, and the "" ids/posters of
+    film-cache entries from older runs, become None, i.e. Parquet nulls.
+    """
+    page_info = page_info or {}
+    for name, column in columns.items():
+        column[i] = film.get(name) or page_info.get(name) or None
+
+def write_parquet(columns: dict[str, list], path: str) -> None:
+    # pyarrow is only needed to write the output, so importers of the
+    # fetch helpers (getUserMovies) don't pay for loading it
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, pa.type_for_alias(alias)) for name, alias in FILM_COLUMNS.items()])
+    pq.write_table(pa.table(columns, schema=schema), path)
+
+
+async def crawl(user: str, session: ClientSession | None = None) -> dict[str, list]:
+    """
+    Grid listing and per-film fetches for one user, over a single session.
+    Pass a session to reuse it (and its warm connection pool) across a
+    batch of users; otherwise one is opened for this crawl only.
+    Raises whatever fetch_all_slugs raised (e.g. RuntimeError for a user
+    with no visible films), so a batch can skip that user and carry on.
+    """
+    if session is None:
+        async with make_session() as session:
+            return await crawl(user, session)
+
+    # each user starts from a clean cookie jar, like a fresh session would
+    session.cookie_jar.clear()
+    print(f"Fetching all films for {user}...")
+    films = await fetch_all_slugs(user, session)
+    print(f"  Found {len(films)} films.")
+
+    print("Now fetching film pages asynchronously…")
+    return await gather_everything(films, session)
 
 
 
 # ─────── STEP 4: Put it all together in __main__ ───────
 
 if __name__ == "__main__":
-    import json
-    import sys
-
     if len(sys.argv) < 2:
-        print("Usage: python scrape_letterboxd.py <letterboxd_username>")
+        print("Usage: python scrape_letterboxd.py <letterboxd_username> [output.parquet]")
         sys.exit(1)
 
     user = sys.argv[1]
-    print(f"Fetching all film-slugs for {user}...")
+    out_path = sys.argv[2] if len(sys.argv) > 2 else "films.parquet"
     try:
-        slugs = fetch_all_slugs(user)  
-        print(f"  Found {len(slugs)} slugs.")
+        columns = asyncio.run(crawl(user))
     except Exception as e:
         print("Error while scraping slugs:", e)
         sys.exit(1)
 
-    # If you have 2000+ films, you might chunk this to avoid rate‐limiting:
-    # e.g. chunk_size = 50, then do gather_everything on each chunk in a loop.
-    # For simplicity, we'll just do them all at once here. 
-
-    print("Now fetching film pages + poster URLs asynchronously…")
-    movie_dicts = asyncio.run(gather_everything(slugs))
-
-    # Dump to JSON on stdout (or write to a file)
-    print(json.dumps(movie_dicts, indent=2))
-    # Or: with open("my_films.json","w") as f: json.dump(movie_dicts, f, indent=2)
+    # Parquet keeps the columns typed and loads straight into pandas/pyarrow downstream
+    write_parquet(columns, out_path)
+    print(f"Wrote {len(columns['slug'])} films to {out_path}")
 
     print("Done.")
 
@@ -1,165 +1,160 @@
 import asyncio
-import aiohttp
 import pprint 
 from aiohttp import ClientSession
-from bs4 import BeautifulSoup
-from selenium import webdriver
-
+from lxml import etree
+from ScrapeTest import _has_class, _parse, get_with_retry, make_session
+
+
+# the films grid as served on /<user>/films/…, plus a film page's release year
+_XP_DISPLAY_NAME = etree.XPath(
+    f"//nav[{_has_class('profile-navigation')}]//h1[{_has_class('title-3')}]"
+)
+_XP_PAGE_NUMBERS = etree.XPath(
+    f"//div[{_has_class('paginate-pages')}]//li[{_has_class('paginate-page')}]"
+)
+_XP_ITEMS = etree.XPath(
+    f"//ul[{_has_class('grid')}]/li[{_has_class('griditem')}]"
+)
+_XP_FILM_INFO = etree.XPath(f".//div[{_has_class('react-component')}]")
+_XP_RATING = etree.XPath(f".//span[{_has_class('rating')}]")
+_XP_LIKED = etree.XPath(f".//span[{_has_class('liked-micro')}]")
+_XP_POSTER = etree.XPath(f".//img[{_has_class('image')}]")
+_XP_RELEASE_YEAR = etree.XPath(f"//span[{_has_class('releasedate')}]//a/text()")
+
+
+def extract_year(tree) -> str | None:
+    """
+    Pull the release year out of a parsed movie detail page.
+    """
+    years = _XP_RELEASE_YEAR(tree)
+    return years[0].strip() if years else None
 
-def parse_year_from_html(html: str) -> str | None:
+def parse_year_from_html(html: bytes) -> str | None:
     """
     Parse the release year from a movie detail page HTML.
     """
-    soup = BeautifulSoup(html, "lxml")
-    span = soup.find("span", class_="releasedate")
-    if span:
-        a = span.find("a")
-        if a and a.text:
-            return a.text.strip()
-    return None
+    return extract_year(_parse(html))
 
 async def fetch_year(session: ClientSession, slug: str) -> str | None:
     """
     Fetch the movie detail page for a given slug and extract the release year.
     """
     url = f"https://letterboxd.com/film/{slug}/"
-    try:
-        async with session.get(url) as resp:
-            if resp.status == 200:
-                html = await resp.text()
-                return parse_year_from_html(html)
-    except Exception:
-        return None
-    return None
+    html = await get_with_retry(session, url)
+    return extract_year(_parse(html)) if html else None
+
+# Letterboxd only ever renders these ten star strings ("½" … "★★★★★")
+_STAR_TABLE = {"★" * (score // 2) + "½" * (score % 2): score for score in range(1, 11)}
 
 def stars_to_score(star_str: str) -> int | None:
     """
     Convert a Letterboxd star string (e.g. "★★★★", "★★★½", "") 
     into an integer 0–10 score, or None if no rating.
     """
-    if not star_str:
-        return None
-
-    full = star_str.count("★")
-    half = star_str.count("½")
-    # Cap in case something odd slipped through
-    full = min(full, 5)
-    half = min(half, 1)
-
-    return full * 2 + half
+    return _STAR_TABLE.get(star_str)
 
 async def fetch_rating_info(
     username: str,
     max_pages: int = 50,
-    driver_path: str = None,
-    headless: bool = True,
-    fetch_years: bool = False
+    fetch_years: bool = False,
+    concurrency: int = 4
 ) -> list[dict]:
     """
-    Async version of fetch_movie_info.  All blocking Selenium calls
-    are run in a thread-pool so as not to block asyncio's event loop.
+    Async version of fetch_movie_info.  Letterboxd serves the film grid
+    server-rendered, so every page is a plain aiohttp GET over one
+    shared session; no browser is involved.  Up to `concurrency` pages
+    are in flight at once and the results are stitched back in page order.
 
     If fetch_years is True, the function will visit each movie's slug URL
     to retrieve and fill in the 'year' field.
     """
-    loop = asyncio.get_running_loop()
-
-    # set up Chrome *in a thread*
-    def _make_driver():
-        opts = webdriver.ChromeOptions()
-       #if headless:
-           # opts.add_argument("--headless")
-        opts.add_argument("--no-proxy-server")
-        opts.add_argument("--proxy-bypass-list=*")
-                          
-        if driver_path:
-            return webdriver.Chrome(options=opts, executable_path=driver_path)
-        else:
-            return webdriver.Chrome(options=opts)
-
-    driver = await loop.run_in_executor(None, _make_driver)
     all_films: list[dict] = []
+    displayName = None
+    lastPage = max_pages
 
-    #get the user display name. will be added to every dict for quicker operations as it can be retrieved from the initial soup 
-
-    try: 
-        url = f"https://letterboxd.com/{username}/films/"
-
-        await loop.run_in_executor(None, driver.get,url)
-        await asyncio.sleep(1.5)
-        html = await loop.run_in_executor(None, lambda: driver.page_source)
-        soup = BeautifulSoup(html, "lxml")
+    async with make_session() as session:
 
-        displayNameLocation = soup.find("nav", class_ = "profile-navigation").find("h1", class_ ="title-3")
-        displayName = displayNameLocation.get_text(strip=True) if displayNameLocation else None
+        #get the user display name. will be added to every dict for quicker operations as it can be retrieved from the initial page 
+        #the pagination on the same page tells us how many pages to fetch
 
-    except Exception as e:
-        # handle/log the error, then skip to the next page
-        print(f"failed display name retrieval for {username} exception:{e}")
+        try: 
+            url = f"https://letterboxd.com/{username}/films/"
 
-    
+            html = await get_with_retry(session, url)
+            # an error page has no pagination; don't let it pass for a 1-page user
+            if html is None:
+                raise RuntimeError("profile page failed after retries")
+            tree = _parse(html)
 
-    try:
-        for page in range(1, max_pages + 1):
-            url = f"https://letterboxd.com/{username}/films/by/date-earliest/page/{page}/"
+            displayNameLocation = _XP_DISPLAY_NAME(tree)
+            displayName = displayNameLocation[0].text_content().strip() if displayNameLocation else None
 
-            # navigate → in thread
-            await loop.run_in_executor(None, driver.get, url)
-            # give React time to render
-            await asyncio.sleep(1.5)
+            pageNumbers = [li.text_content().strip() for li in _XP_PAGE_NUMBERS(tree)]
+            lastPage = min(max((int(n) for n in pageNumbers if n.isdigit()), default=1), max_pages)
 
-            # grab HTML
-            html = await loop.run_in_executor(None, lambda: driver.page_source)
-            soup = BeautifulSoup(html, "lxml")
+        except Exception as e:
+            # handle/log the error, fall back to walking up to max_pages
+            print(f"failed display name retrieval for {username} exception:{e}")
 
-            ul = soup.find("ul", class_="poster-list -p70 -grid clear")
-            if not ul:
-                break
+        semaphore = asyncio.Semaphore(concurrency)
 
-            items = ul.find_all("li", class_="poster-container")
-            if not items:
-                break
+        async def fetch_page(page: int) -> list[dict]:
+            url = f"https://letterboxd.com/{username}/films/by/date-earliest/page/{page}/"
 
-            for li in items:
-                print(li)
-                filmInfo = li.find(
-                    "div",
-                    class_="react-component poster film-poster linked-film-poster"
-                )
-                ratingLocation = li.find("span", class_="rating")
-                rating = ratingLocation.get_text(strip=True) if ratingLocation else None
+            async with semaphore:
+                html = await get_with_retry(session, url)
+            if html is None:
+                # a page lost to rate limiting would silently cut the list short;
+                # fail the whole fetch instead, and skip the later pages
+                for task in tasks[page:]:
+                    task.cancel()
+                raise RuntimeError(f"failed to fetch page {page} for {username} after retries")
+            tree = _parse(html)
+
+            films = []
+            for li in _XP_ITEMS(tree):
+                filmInfo = _XP_FILM_INFO(li)
+                ratingLocation = _XP_RATING(li)
+                rating = (ratingLocation[0].text or "").strip() if ratingLocation else None
                 rating = stars_to_score(rating)
 
 
-                likedTag = li.find(
-                    "span", class_="like liked-micro has-icon icon-liked icon-16"
-                )
+                likedTag = _XP_LIKED(li)
                 liked = bool(likedTag)
 
-                posterLocation = li.find("img", class_ = "image")
-                posterURL  = posterLocation.get("src")
+                posterLocation = _XP_POSTER(li)
+                posterURL  = posterLocation[0].get("src") if posterLocation else None
 
 
                 if not filmInfo:
                     continue
+                filmInfo = filmInfo[0]
 
-                all_films.append({
-                    "slug":       filmInfo.get("data-film-slug"),
-                    "title":      filmInfo.get("data-film-name"),
+                films.append({
+                    "slug":       filmInfo.get("data-item-slug"),
+                    "title":      filmInfo.get("data-item-name"),
                     "year":       None,
                     "poster_url": posterURL,
                     "rating":     rating,
                     "liked":      liked,
                     "display_name": displayName if displayName else None
                 })
-    finally:
-        # quit driver
-        await loop.run_in_executor(None, driver.quit)
-
-    # Optionally fetch years for each slug
-    if fetch_years and all_films:
-        semaphore = asyncio.Semaphore(25)
-        async with aiohttp.ClientSession() as session:
+            return films
+
+        tasks = [asyncio.create_task(fetch_page(page)) for page in range(1, lastPage + 1)]
+        pages = await asyncio.gather(*tasks, return_exceptions=True)
+
+        # keep pages in order, stopping at the first failed or empty one
+        for films in pages:
+            if isinstance(films, Exception):
+                raise films
+            if not isinstance(films, list) or not films:
+                break
+            all_films.extend(films)
+
+        # Optionally fetch years for each slug
+        if fetch_years and all_films:
+            semaphore = asyncio.Semaphore(25)
             async def sem_fetch(film):
                 async with semaphore:
                     film["year"] = await fetch_year(session, film["slug"])
@@ -170,7 +165,7 @@ async def fetch_rating_info(
 
 
 async def main():
-    films = await fetch_rating_info("613dbx", headless=False)
+    films = await fetch_rating_info("613dbx")
     pprint.pprint(films[:5])
     print("…", len(films) - 5, "more")
     #pprint(films)